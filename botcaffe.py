@@ -1,17 +1,27 @@
 import os
 import asyncio
 import logging
-import sqlite3
-import pytz
+import re
+from contextlib import asynccontextmanager
+import aiosqlite
 from datetime import datetime
+from zoneinfo import ZoneInfo
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
+# uvloop — необязательная зависимость, ускоряет событийный цикл
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 # Загрузка переменных окружения
 load_dotenv()
 
@@ -20,6 +30,9 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     raise ValueError("Токен бота не найден в .env файле!")
 
+# Необязательный Redis для хранения состояний FSM (сохраняются между перезапусками)
+REDIS_URL = os.getenv("REDIS_URL")
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -27,133 +40,345 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Часовой пояс антикафе
+MSK = ZoneInfo("Europe/Moscow")
+
+# Администраторы, добавляемые при запуске (замените на свои ID)
+ADMIN_IDS = (586842186,)
+
+# Интервал фоновой записи посещений в БД, секунды
+VISITS_FLUSH_INTERVAL = 0.1
+
+# Формат даты события ДД.ММ.ГГГГ ЧЧ:ММ (как у strptime, допускаются однозначные числа)
+DATE_RE = re.compile(r"(\d{1,2})\.(\d{1,2})\.(\d{4}) (\d{1,2}):(\d{1,2})")
+
+# Максимальное количество предстоящих событий, показываемых пользователю
+EVENTS_LIMIT = 50
+
+# Время жизни состояний FSM в Redis, секунды (брошенные диалоги удаляются)
+FSM_TTL = 3600
+
+# Количество одновременных отправок при рассылке
+MAILING_CONCURRENCY = 30
+
+# Темп рассылки, сообщений в секунду (глобальный лимит Telegram ~30 сообщений/с)
+MAILING_RATE = 29
+
+# Количество попыток отправки одному пользователю при TelegramRetryAfter
+MAILING_ATTEMPTS = 3
+
 # Инициализация бота
+# Общий пул постоянных соединений к api.telegram.org
+session = AiohttpSession(limit=100)
+session._connector_init.update(limit_per_host=100, keepalive_timeout=60)
+
 bot = Bot(
     token=BOT_TOKEN,
+    session=session,
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
-storage = MemoryStorage()
+# FSM-хранилище: Redis, если задан REDIS_URL, иначе память процесса.
+# Бот рассчитан только на один процесс даже с Redis: кэши Database
+# (admins, visit_counts) и очередь посещений живут в памяти процесса
+if REDIS_URL:
+    from aiogram.fsm.storage.redis import RedisStorage
+    storage = RedisStorage.from_url(REDIS_URL, state_ttl=FSM_TTL, data_ttl=FSM_TTL)
+else:
+    storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
 
 # Подключение к БД
+PRAGMAS_SQL = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=memory;
+PRAGMA cache_size=-64000;
+PRAGMA mmap_size=268435456;
+PRAGMA busy_timeout=5000;
+"""
+
+CREATE_TABLES_SQL = """
+CREATE TABLE IF NOT EXISTS users
+    (user_id INTEGER PRIMARY KEY,
+     username TEXT,
+     full_name TEXT,
+     phone TEXT,
+     reg_date TEXT,
+     visits_count INTEGER DEFAULT 0);
+
+CREATE TABLE IF NOT EXISTS visits
+    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+     user_id INTEGER,
+     visit_date TEXT,
+     FOREIGN KEY(user_id) REFERENCES users(user_id));
+
+CREATE TABLE IF NOT EXISTS events
+    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+     title TEXT,
+     description TEXT,
+     event_date TEXT,
+     photo_id TEXT);
+
+CREATE TABLE IF NOT EXISTS admins
+    (user_id INTEGER PRIMARY KEY);
+
+CREATE INDEX IF NOT EXISTS idx_visits_user_id ON visits(user_id);
+CREATE INDEX IF NOT EXISTS idx_events_date ON events(event_date);
+"""
+
+# Счётчик посещений в users поддерживается триггером, чтобы не делать COUNT(*) по visits
+CREATE_TRIGGERS_SQL = """
+CREATE TRIGGER IF NOT EXISTS incr_visits AFTER INSERT ON visits
+BEGIN
+    UPDATE users SET visits_count = visits_count + 1 WHERE user_id = NEW.user_id;
+END;
+"""
+
+# Запросы вынесены в константы: одна и та же строка переиспользует
+# подготовленное выражение из кэша sqlite3
+SQL_GET_ADMINS = "SELECT user_id FROM admins"
+SQL_ADD_ADMIN = "INSERT OR IGNORE INTO admins VALUES (?)"
+SQL_ADD_USER = "INSERT OR IGNORE INTO users (user_id, username, full_name, reg_date) VALUES (?, ?, ?, ?)"
+SQL_UPDATE_PHONE = "UPDATE users SET phone = ? WHERE user_id = ?"
+SQL_ADD_VISIT = "INSERT INTO visits (user_id, visit_date) VALUES (?, ?)"
+SQL_GET_VISITS_COUNT = "SELECT visits_count FROM users WHERE user_id = ?"
+SQL_GET_ALL_USERS = "SELECT user_id FROM users"
+SQL_GET_TOTALS = "SELECT COUNT(*), COALESCE(SUM(visits_count), 0) FROM users"
+SQL_GET_TOP_USERS = "SELECT full_name, visits_count FROM users ORDER BY visits_count DESC LIMIT 5"
+SQL_ADD_EVENT = "INSERT INTO events (title, description, event_date, photo_id) VALUES (?, ?, ?, ?)"
+SQL_GET_EVENTS = (
+    "SELECT id, title, description, strftime('%d.%m.%Y в %H:%M', event_date), photo_id "
+    "FROM events WHERE event_date >= ? ORDER BY event_date LIMIT ?"
+)
+
 class Database:
-    def __init__(self):
-        self.conn = sqlite3.connect("anticafe.db", check_same_thread=False)
-        self.cursor = self.conn.cursor()
-        self._create_tables()
+    """Работа с базой данных.
 
-    def _create_tables(self):
-        """Создание таблиц в базе данных"""
-        self.cursor.execute("""CREATE TABLE IF NOT EXISTS users
-                     (user_id INTEGER PRIMARY KEY, 
-                      username TEXT, 
-                      full_name TEXT,
-                      phone TEXT,
-                      reg_date TEXT)""")
-
-        self.cursor.execute("""CREATE TABLE IF NOT EXISTS visits
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      user_id INTEGER,
-                      visit_date TEXT,
-                      FOREIGN KEY(user_id) REFERENCES users(user_id))""")
-
-        self.cursor.execute("""CREATE TABLE IF NOT EXISTS events
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      title TEXT,
-                      description TEXT,
-                      event_date TEXT,
-                      photo_id TEXT)""")
-        
-        self.cursor.execute("""CREATE TABLE IF NOT EXISTS admins
-                     (user_id INTEGER PRIMARY KEY)""")
-        
-        self.conn.commit()
+    aiosqlite выполняет все запросы в одном выделенном потоке, поэтому
+    обращения к БД не блокируют событийный цикл и выполняются по очереди.
+    Соединение работает в режиме autocommit: одиночные запросы фиксируются
+    сразу, а несколько записей объединяются в транзакцию через batch().
+    Соединение общее для всех задач, поэтому транзакция защищена блокировкой:
+    запись из другой задачи ждёт её завершения, а не попадает внутрь.
 
-    def add_admin(self, user_id):
+    Кэши admins и visit_counts и очередь посещений не разделяются между
+    процессами, поэтому с базой должен работать только один процесс бота.
+    """
+
+    def __init__(self):
+        self.conn = None
+        self.admins = set()
+        self.visit_counts = {}
+        self._tx_lock = asyncio.Lock()
+        self._tx_owner = None
+        self.visit_queue = None
+        self._flush_task = None
+
+    async def connect(self, path="anticafe.db"):
+        """Открытие соединения с базой данных"""
+        self.conn = await aiosqlite.connect(path, isolation_level=None, cached_statements=256)
+        await self._create_tables()
+        await self._load_admins()
+        self.visit_queue = asyncio.Queue()
+        self._flush_task = asyncio.create_task(self._flush_visits_loop())
+
+    async def close(self):
+        """Закрытие соединения с базой данных"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        if self.conn is not None:
+            try:
+                await self.flush_visits()
+            except Exception as e:
+                logger.error(f"Не удалось записать посещения при закрытии: {self.visit_queue.qsize()} шт., {e}")
+            await self.conn.close()
+            self.conn = None
+
+    async def _flush_visits_loop(self):
+        """Фоновая запись накопленных посещений"""
+        while True:
+            await asyncio.sleep(VISITS_FLUSH_INTERVAL)
+            try:
+                await self.flush_visits()
+            except Exception as e:
+                logger.error(f"Ошибка записи посещений: {e}")
+
+    async def flush_visits(self):
+        """Запись всех посещений из очереди одной транзакцией"""
+        # Внутри своего batch() не пишем: его откат потерял бы уже снятые с очереди посещения
+        if self._tx_owner is asyncio.current_task():
+            return
+        pending = []
+        while not self.visit_queue.empty():
+            pending.append(self.visit_queue.get_nowait())
+        if not pending:
+            return
+        try:
+            async with self.batch():
+                await self.conn.executemany(SQL_ADD_VISIT, pending)
+        except BaseException:
+            # Посещения уже засчитаны пользователю — возвращаем их для следующей попытки
+            for row in pending:
+                self.visit_queue.put_nowait(row)
+            raise
+
+    async def _create_tables(self):
+        """Создание таблиц в базе данных"""
+        # WAL и synchronous=NORMAL: читатели не блокируют запись, меньше fsync на commit
+        await self.conn.executescript(PRAGMAS_SQL)
+        await self.conn.executescript(CREATE_TABLES_SQL)
+        await self._migrate()
+        await self.conn.executescript(CREATE_TRIGGERS_SQL)
+
+    async def _migrate(self):
+        """Обновление схемы существующей базы данных"""
+        async with self.conn.execute("PRAGMA table_info(users)") as cur:
+            columns = {row[1] for row in await cur.fetchall()}
+        if "visits_count" not in columns:
+            async with self.batch():
+                await self.conn.execute("ALTER TABLE users ADD COLUMN visits_count INTEGER DEFAULT 0")
+                await self.conn.execute(
+                    "UPDATE users SET visits_count = "
+                    "(SELECT COUNT(*) FROM visits WHERE visits.user_id = users.user_id)"
+                )
+
+    @asynccontextmanager
+    async def batch(self):
+        """Группировка нескольких записей в одну транзакцию с одним commit"""
+        task = asyncio.current_task()
+        if self._tx_owner is task:
+            # Вложенный batch() той же задачи — уже внутри транзакции
+            yield
+            return
+        async with self._tx_lock:
+            self._tx_owner = task
+            try:
+                await self.conn.execute("BEGIN")
+                try:
+                    yield
+                except BaseException:
+                    await self.conn.rollback()
+                    # Кэш админов мог учесть отменённые записи. Посещения пишутся
+                    # только через очередь и при ошибке возвращаются в неё,
+                    # поэтому visit_counts остаётся верным
+                    await self._load_admins()
+                    raise
+                await self.conn.commit()
+            finally:
+                self._tx_owner = None
+
+    async def _write(self, sql, params):
+        """Одиночная запись: не выполняется внутри чужой открытой транзакции"""
+        if self._tx_owner is asyncio.current_task():
+            await self.conn.execute(sql, params)
+            return
+        async with self._tx_lock:
+            await self.conn.execute(sql, params)
+
+    async def _load_admins(self):
+        """Загрузка списка администраторов в память"""
+        async with self.conn.execute(SQL_GET_ADMINS) as cur:
+            self.admins = {row[0] for row in await cur.fetchall()}
+
+    async def add_admin(self, user_id):
         """Добавление администратора"""
-        self.cursor.execute("INSERT OR IGNORE INTO admins VALUES (?)", (user_id,))
-        self.conn.commit()
+        await self._write(SQL_ADD_ADMIN, (user_id,))
+        self.admins.add(user_id)
 
     def is_admin(self, user_id):
-        """Проверка прав администратора"""
-        self.cursor.execute("SELECT 1 FROM admins WHERE user_id = ?", (user_id,))
-        return bool(self.cursor.fetchone())
+        """Проверка прав администратора (по кэшу в памяти)"""
+        return user_id in self.admins
 
-    def add_user(self, user_id, username, full_name):
+    async def add_user(self, user_id, username, full_name):
         """Добавление нового пользователя"""
-        reg_date = datetime.now(pytz.timezone('Europe/Moscow')).strftime("%Y-%m-%d %H:%M:%S")
-        self.cursor.execute(
-            "INSERT OR IGNORE INTO users (user_id, username, full_name, reg_date) VALUES (?, ?, ?, ?)",
-            (user_id, username, full_name, reg_date)
-        )
-        self.conn.commit()
+        reg_date = datetime.now(MSK).strftime("%Y-%m-%d %H:%M:%S")
+        await self._write(SQL_ADD_USER, (user_id, username, full_name, reg_date))
 
-    def update_phone(self, user_id, phone):
+    async def update_phone(self, user_id, phone):
         """Обновление номера телефона"""
-        self.cursor.execute(
-            "UPDATE users SET phone = ? WHERE user_id = ?",
-            (phone, user_id)
-        )
-        self.conn.commit()
+        await self._write(SQL_UPDATE_PHONE, (phone, user_id))
 
-    def add_visit(self, user_id):
+    async def add_visit(self, user_id):
         """Добавление посещения"""
-        visit_date = datetime.now(pytz.timezone('Europe/Moscow')).strftime("%Y-%m-%d %H:%M:%S")
-        self.cursor.execute(
-            "INSERT INTO visits (user_id, visit_date) VALUES (?, ?)",
-            (user_id, visit_date)
-        )
-        self.conn.commit()
-        return self.get_visits_count(user_id)
-
-    def get_visits_count(self, user_id):
-        """Получение количества посещений"""
-        self.cursor.execute(
-            "SELECT COUNT(*) FROM visits WHERE user_id = ?",
-            (user_id,)
-        )
-        return self.cursor.fetchone()[0]
-
-    def get_all_users(self):
+        visit_date = datetime.now(MSK).strftime("%Y-%m-%d %H:%M:%S")
+        await self.get_visits_count(user_id)
+        self.visit_counts[user_id] += 1
+        # Сама запись в БД выполняется пачкой в flush_visits()
+        self.visit_queue.put_nowait((user_id, visit_date))
+        return self.visit_counts[user_id]
+
+    async def get_visits_count(self, user_id):
+        """Получение количества посещений (с кэшированием в памяти)"""
+        if user_id in self.visit_counts:
+            return self.visit_counts[user_id]
+        await self.flush_visits()
+        async with self.conn.execute(SQL_GET_VISITS_COUNT, (user_id,)) as cur:
+            row = await cur.fetchone()
+        # Параллельный запрос мог уже заполнить кэш
+        return self.visit_counts.setdefault(user_id, row[0] if row else 0)
+
+    async def get_all_users(self):
         """Получение списка всех пользователей"""
-        self.cursor.execute("SELECT user_id FROM users")
-        return [row[0] for row in self.cursor.fetchall()]
+        async with self.conn.execute(SQL_GET_ALL_USERS) as cur:
+            return [row[0] for row in await cur.fetchall()]
 
-    def get_stats(self):
+    async def get_stats(self):
         """Получение статистики"""
-        self.cursor.execute("SELECT COUNT(*) FROM users")
-        total_users = self.cursor.fetchone()[0]
-        
-        self.cursor.execute("SELECT COUNT(*) FROM visits")
-        total_visits = self.cursor.fetchone()[0]
-        
-        self.cursor.execute("""
-            SELECT u.full_name, COUNT(v.id) as visits 
-            FROM users u
-            LEFT JOIN visits v ON u.user_id = v.user_id
-            GROUP BY u.user_id
-            ORDER BY visits DESC
-            LIMIT 5
-        """)
-        top_users = self.cursor.fetchall()
-        
+        await self.flush_visits()
+        async with self.conn.execute(SQL_GET_TOTALS) as cur:
+            total_users, total_visits = await cur.fetchone()
+
+        async with self.conn.execute(SQL_GET_TOP_USERS) as cur:
+            top_users = await cur.fetchall()
+
         return total_users, total_visits, top_users
 
-    def add_event(self, title, description, event_date, photo_id=None):
+    async def add_event(self, title, description, event_date, photo_id=None):
         """Добавление события"""
-        self.cursor.execute(
-            "INSERT INTO events (title, description, event_date, photo_id) VALUES (?, ?, ?, ?)",
-            (title, description, event_date, photo_id)
-        )
-        self.conn.commit()
+        await self._write(SQL_ADD_EVENT, (title, description, event_date, photo_id))
 
-    def get_events(self):
-        """Получение списка событий"""
-        self.cursor.execute("SELECT * FROM events ORDER BY event_date")
-        return self.cursor.fetchall()
+    async def get_events(self):
+        """Получение списка предстоящих событий (дата уже отформатирована для вывода)"""
+        # Даты событий хранятся по московскому времени, прошедшие не показываем
+        now = datetime.now(MSK).strftime("%Y-%m-%d %H:%M:%S")
+        async with self.conn.execute(SQL_GET_EVENTS, (now, EVENTS_LIMIT)) as cur:
+            return await cur.fetchall()
 
+# Соединение открывается в main()
 db = Database()
 
+# Клавиатуры статичны, поэтому создаются один раз при загрузке модуля
+CONTACT_KB = types.ReplyKeyboardMarkup(
+    keyboard=[[types.KeyboardButton(text="📞 Отправить номер", request_contact=True)]],
+    resize_keyboard=True
+)
+
+MAIN_MENU_KB = types.ReplyKeyboardMarkup(
+    keyboard=[
+        [types.KeyboardButton(text="☕ Отметить посещение")],
+        [types.KeyboardButton(text="🎁 Мои бонусы"), types.KeyboardButton(text="📅 События")],
+        [types.KeyboardButton(text="📱 Контакты"), types.KeyboardButton(text="✉️ Отзыв")]
+    ],
+    resize_keyboard=True
+)
+
+ADMIN_KB = types.ReplyKeyboardMarkup(
+    keyboard=[
+        [types.KeyboardButton(text="📊 Статистика")],
+        [types.KeyboardButton(text="📢 Рассылка")],
+        [types.KeyboardButton(text="➕ Добавить событие")],
+        [types.KeyboardButton(text="◀️ В главное меню")]
+    ],
+    resize_keyboard=True
+)
+
+REMOVE_KB = types.ReplyKeyboardRemove()
+
 # Состояния FSM
 class Form(StatesGroup):
     phone = State()
@@ -164,39 +389,32 @@ class Form(StatesGroup):
     mailing_message = State()
     feedback = State()
 
-# Проверка прав администратора
-async def is_admin(user_id: int) -> bool:
-    return db.is_admin(user_id)
-
 # ---- Основные команды ----
 
 @dp.message(F.text == "/start")
 async def cmd_start(message: types.Message):
-    db.add_user(message.from_user.id, message.from_user.username, message.from_user.full_name)
+    await db.add_user(message.from_user.id, message.from_user.username, message.from_user.full_name)
     
     await message.answer(
         f"👋 Привет, {message.from_user.full_name}!\n"
         "Добро пожаловать в наше антикафе!\n\n"
         "📱 Поделитесь номером телефона для программы лояльности:",
-        reply_markup=types.ReplyKeyboardMarkup(
-            keyboard=[[types.KeyboardButton(text="📞 Отправить номер", request_contact=True)]],
-            resize_keyboard=True
-        )
+        reply_markup=CONTACT_KB
     )
 
 @dp.message(F.contact)
 async def process_phone(message: types.Message):
-    db.update_phone(message.from_user.id, message.contact.phone_number)
+    await db.update_phone(message.from_user.id, message.contact.phone_number)
     await message.answer(
         "✅ Теперь вы участник программы лояльности!",
-        reply_markup=types.ReplyKeyboardRemove()
+        reply_markup=REMOVE_KB
     )
     await show_main_menu(message)
 
 # ---- Программа лояльности ----
 
 async def show_main_menu(message: types.Message):
-    visits_count = db.get_visits_count(message.from_user.id)
+    visits_count = await db.get_visits_count(message.from_user.id)
     remaining = 7 - (visits_count % 7) if visits_count % 7 != 0 else 0
     
     text = (
@@ -210,19 +428,11 @@ async def show_main_menu(message: types.Message):
     
     await message.answer(
         text,
-        reply_markup=types.ReplyKeyboardMarkup(
-            keyboard=[
-                [types.KeyboardButton(text="☕ Отметить посещение")],
-                [types.KeyboardButton(text="🎁 Мои бонусы"), types.KeyboardButton(text="📅 События")],
-                [types.KeyboardButton(text="📱 Контакты"), types.KeyboardButton(text="✉️ Отзыв")]
-            ],
-            resize_keyboard=True
-        )
+        reply_markup=MAIN_MENU_KB
     )
 
-@dp.message(F.text == "☕ Отметить посещение")
-async def mark_visit(message: types.Message):
-    visits_count = db.add_visit(message.from_user.id)
+async def mark_visit(message: types.Message, state: FSMContext):
+    visits_count = await db.add_visit(message.from_user.id)
     
     if visits_count % 7 == 0:
         await message.answer("🎉 Поздравляем! Ваше посещение №7 - бесплатный кофе!")
@@ -234,27 +444,23 @@ async def mark_visit(message: types.Message):
     
     await show_main_menu(message)
 
-@dp.message(F.text == "🎁 Мои бонусы")
-async def show_bonuses(message: types.Message):
-    visits_count = db.get_visits_count(message.from_user.id)
+async def show_bonuses(message: types.Message, state: FSMContext):
+    visits_count = await db.get_visits_count(message.from_user.id)
     await message.answer(
         f"Ваша карта лояльности:\n\n"
         f"☕ Посещений: {visits_count}\n"
         f"🎁 До бесплатного кофе: {7 - (visits_count % 7)}"
     )
 
-@dp.message(F.text == "📅 События")
-async def show_events(message: types.Message):
-    events = db.get_events()
+async def show_events(message: types.Message, state: FSMContext):
+    events = await db.get_events()
     
     if not events:
         await message.answer("На данный момент нет запланированных событий.")
         return
     
     for event in events:
-        event_id, title, description, event_date, photo_id = event
-        formatted_date = datetime.strptime(event_date, "%Y-%m-%d %H:%M:%S").strftime("%d.%m.%Y в %H:%M")
-        
+        event_id, title, description, formatted_date, photo_id = event
         text = f"🎪 <b>{title}</b>\n📅 {formatted_date}\n\n{description}"
         
         if photo_id:
@@ -266,81 +472,85 @@ async def show_events(message: types.Message):
 
 @dp.message(F.text == "/admin")
 async def admin_panel(message: types.Message):
-    if not await is_admin(message.from_user.id):
+    if not db.is_admin(message.from_user.id):
         await message.answer("⛔ У вас нет прав администратора")
         return
     
     await message.answer(
         "👨‍💻 Панель администратора:",
-        reply_markup=types.ReplyKeyboardMarkup(
-            keyboard=[
-                [types.KeyboardButton(text="📊 Статистика")],
-                [types.KeyboardButton(text="📢 Рассылка")],
-                [types.KeyboardButton(text="➕ Добавить событие")],
-                [types.KeyboardButton(text="◀️ В главное меню")]
-            ],
-            resize_keyboard=True
-        )
+        reply_markup=ADMIN_KB
     )
 
-@dp.message(F.text == "📊 Статистика")
-async def show_stats(message: types.Message):
-    if not await is_admin(message.from_user.id):
+async def show_stats(message: types.Message, state: FSMContext):
+    if not db.is_admin(message.from_user.id):
         return
     
-    total_users, total_visits, top_users = db.get_stats()
+    total_users, total_visits, top_users = await db.get_stats()
     
-    text = (
-        f"📊 Статистика:\n\n"
-        f"👥 Пользователей: {total_users}\n"
-        f"🔄 Посещений: {total_visits}\n\n"
-        f"🏆 Топ-5 клиентов:\n"
-    )
+    lines = [
+        "📊 Статистика:\n",
+        f"👥 Пользователей: {total_users}",
+        f"🔄 Посещений: {total_visits}\n",
+        "🏆 Топ-5 клиентов:",
+    ]
+    lines.extend(f"{i}. {name}: {visits} посещений" for i, (name, visits) in enumerate(top_users, 1))
     
-    for i, (name, visits) in enumerate(top_users, 1):
-        text += f"{i}. {name}: {visits} посещений\n"
-    
-    await message.answer(text)
+    await message.answer("\n".join(lines))
 
-@dp.message(F.text == "📢 Рассылка")
 async def start_mailing(message: types.Message, state: FSMContext):
-    if not await is_admin(message.from_user.id):
+    if not db.is_admin(message.from_user.id):
         return
     
     await message.answer(
         "Введите сообщение для рассылки:",
-        reply_markup=types.ReplyKeyboardRemove()
+        reply_markup=REMOVE_KB
     )
     await state.set_state(Form.mailing_message)
 
 @dp.message(Form.mailing_message)
 async def process_mailing(message: types.Message, state: FSMContext):
-    users = db.get_all_users()
-    success = 0
-    
-    for user_id in users:
-        try:
-            await bot.send_message(user_id, message.text)
-            success += 1
-        except Exception as e:
-            logger.error(f"Ошибка отправки пользователю {user_id}: {e}")
+    # Сбрасываем состояние сразу, чтобы оно не зависло при ошибке рассылки
+    await state.clear()
+    users = await db.get_all_users()
+    sem = asyncio.Semaphore(MAILING_CONCURRENCY)
+    # Отправки стартуют не чаще MAILING_RATE раз в секунду: следующая ждёт освобождения паузы
+    pace = asyncio.Lock()
+
+    async def send_one(user_id):
+        async with sem:
+            for attempt in range(1, MAILING_ATTEMPTS + 1):
+                async with pace:
+                    await asyncio.sleep(1 / MAILING_RATE)
+                try:
+                    await bot.send_message(user_id, message.text)
+                    return 1
+                except TelegramRetryAfter as e:
+                    # Telegram просит подождать из-за flood-лимита
+                    if attempt == MAILING_ATTEMPTS:
+                        logger.error(f"Ошибка отправки пользователю {user_id}: {e}")
+                        return 0
+                    await asyncio.sleep(e.retry_after)
+                except Exception as e:
+                    logger.error(f"Ошибка отправки пользователю {user_id}: {e}")
+                    return 0
+
+    results = await asyncio.gather(*(send_one(user_id) for user_id in users), return_exceptions=True)
+    success = sum(r for r in results if isinstance(r, int))
     
     await message.answer(
         f"📤 Рассылка завершена!\n"
         f"✅ Успешно отправлено: {success}/{len(users)}",
-        reply_markup=types.ReplyKeyboardRemove()
+        reply_markup=REMOVE_KB
     )
-    await state.clear()
     await admin_panel(message)
 
-@dp.message(F.text == "➕ Добавить событие")
 async def start_adding_event(message: types.Message, state: FSMContext):
-    if not await is_admin(message.from_user.id):
+    if not db.is_admin(message.from_user.id):
         return
     
     await message.answer(
         "Введите название события:",
-        reply_markup=types.ReplyKeyboardRemove()
+        reply_markup=REMOVE_KB
     )
     await state.set_state(Form.event_title)
 
@@ -358,13 +568,21 @@ async def process_event_description(message: types.Message, state: FSMContext):
 
 @dp.message(Form.event_date)
 async def process_event_date(message: types.Message, state: FSMContext):
+    match = DATE_RE.fullmatch(message.text or "")
+    if not match:
+        await message.answer("Неверный формат даты. Введите дату в формате ДД.ММ.ГГГГ ЧЧ:ММ")
+        return
+
+    day, month, year, hour, minute = map(int, match.groups())
     try:
-        event_date = datetime.strptime(message.text, "%d.%m.%Y %H:%M")
-        await state.update_data(event_date=event_date.strftime("%Y-%m-%d %H:%M:%S"))
-        await message.answer("Отправьте фото для события (или напишите 'пропустить'):")
-        await state.set_state(Form.event_photo)
+        event_date = datetime(year, month, day, hour, minute)
     except ValueError:
         await message.answer("Неверный формат даты. Введите дату в формате ДД.ММ.ГГГГ ЧЧ:ММ")
+        return
+
+    await state.update_data(event_date=event_date.strftime("%Y-%m-%d %H:%M:%S"))
+    await message.answer("Отправьте фото для события (или напишите 'пропустить'):")
+    await state.set_state(Form.event_photo)
 
 @dp.message(Form.event_photo)
 async def process_event_photo(message: types.Message, state: FSMContext):
@@ -378,31 +596,29 @@ async def process_event_photo(message: types.Message, state: FSMContext):
         await message.answer("Пожалуйста, отправьте фото или напишите 'пропустить'")
         return
     
-    db.add_event(data['title'], data['description'], data['event_date'], photo_id)
+    # Все данные собраны — сбрасываем состояние до записи в БД
+    await state.clear()
+    await db.add_event(data['title'], data['description'], data['event_date'], photo_id)
     
     await message.answer("✅ Событие успешно добавлено!")
-    await state.clear()
     await admin_panel(message)
 
-@dp.message(F.text == "◀️ В главное меню")
-async def back_to_main_menu(message: types.Message):
+async def back_to_main_menu(message: types.Message, state: FSMContext):
     await show_main_menu(message)
 
 # ---- Дополнительные функции ----
 
-@dp.message(F.text == "📱 Контакты")
-async def show_contacts(message: types.Message):
+async def show_contacts(message: types.Message, state: FSMContext):
     await message.answer(
         "🏠 Наш адрес: ул. Примерная, 123\n"
         "📞 Телефон: +7 (123) 456-78-90\n"
         "🕒 Часы работы: Пн-Пт 10:00-22:00, Сб-Вс 11:00-23:00"
     )
 
-@dp.message(F.text == "✉️ Отзыв")
 async def start_feedback(message: types.Message, state: FSMContext):
     await message.answer(
         "Напишите ваш отзыв или предложение:",
-        reply_markup=types.ReplyKeyboardRemove()
+        reply_markup=REMOVE_KB
     )
     await state.set_state(Form.feedback)
 
@@ -413,13 +629,41 @@ async def process_feedback(message: types.Message, state: FSMContext):
     await state.clear()
     await show_main_menu(message)
 
+# ---- Кнопки меню ----
+
+# Один обработчик на все кнопки: поиск по словарю вместо цепочки фильтров
+BUTTON_HANDLERS = {
+    "☕ Отметить посещение": mark_visit,
+    "🎁 Мои бонусы": show_bonuses,
+    "📅 События": show_events,
+    "📊 Статистика": show_stats,
+    "📢 Рассылка": start_mailing,
+    "➕ Добавить событие": start_adding_event,
+    "◀️ В главное меню": back_to_main_menu,
+    "📱 Контакты": show_contacts,
+    "✉️ Отзыв": start_feedback,
+}
+
+@dp.message(F.text.in_(BUTTON_HANDLERS))
+async def dispatch_button(message: types.Message, state: FSMContext):
+    await BUTTON_HANDLERS[message.text](message, state)
+
 # ---- Запуск бота ----
 
 async def main():
-    # Добавляем администратора при первом запуске
-    db.add_admin()  # Замените на ваш ID
+    await db.connect()
+    # Добавляем администраторов при первом запуске
+    async with db.batch():
+        for admin_id in ADMIN_IDS:
+            await db.add_admin(admin_id)
     
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await db.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())